@@ -2,7 +2,7 @@
 
 """ High-level API classes for an attached GSM modem """
 
-import sys, re, logging, weakref, time, threading, abc, codecs
+import sys, re, logging, weakref, time, threading, abc, codecs, functools, queue
 from datetime import datetime
 from time import sleep
 
@@ -18,6 +18,8 @@ PYTHON_VERSION = sys.version_info[0]
 
 CTRLZ = '\x1a'
 TERMINATOR = '\r'
+# Default for callbacks the user did not supply
+_NOOP = lambda *args, **kwargs: None
 
 if PYTHON_VERSION >= 3:
     xrange = range
@@ -27,6 +29,11 @@ else: #pragma: no cover
     dictValuesIter = dict.itervalues
     dictItemsIter = dict.iteritems
 
+@functools.lru_cache(maxsize=64)
+def _cmgsTextHeader(destination):
+    """ :return: the text-mode AT+CMGS command for the specified destination (cached for repeat recipients) """
+    return 'AT+CMGS="{0}"'.format(destination)
+
 
 class Sms(object):
     """ Abstract SMS message base class """
@@ -135,8 +142,6 @@ class GsmModem(SerialComms):
     CNUM_REGEX = re.compile('^\+CNUM:\s*".*?","(\+{0,1}\d+)",(\d+).*$')
     # Used for parsing new SMS message indications
     CMTI_REGEX = re.compile('^\+CMTI:\s*"([^"]+)",\s*(\d+)$')
-    # Used for parsing SMS message reads (text mode)
-    CMGR_SM_DELIVER_REGEX_TEXT = None
     # Used for parsing SMS status report message reads (text mode)
     CMGR_SM_REPORT_REGEXT_TEXT = None
     # Used for parsing SMS message reads (PDU mode)
@@ -146,12 +151,46 @@ class GsmModem(SerialComms):
     # Used for parsing SMS status reports
     CDSI_REGEX = re.compile('\+CDSI:\s*"([^"]+)",(\d+)$')
     CDS_REGEX  = re.compile('\+CDS:\s*([0-9]+)"$')
+    # Used for identifying unsolicited +CREG network registration notifications (as opposed to AT+CREG? responses)
+    CREG_URC_REGEX = re.compile('^\+CREG:\s*\d(,"[^"]*","[^"]*".*)?$')
+    # Used for identifying unsolicited notifications; the name of the matching group is the notification type
+    URC_REGEX = re.compile(r'^(?:(?P<ring>RING)|(?P<cring>\+CRING)|(?P<cmti>\+CMTI)|(?P<cusd>\+CUSD)|(?P<cdsi>\+CDSI)|(?P<cds>\+CDS)|(?P<creg>\+CREG)|(?P<dtmf>\+DTMF))(?=[:\s]|$)')
+    # Handlers for unsolicited notifications, keyed by URC_REGEX group name; called as handler(self, line, lines)
+    _NOTIFICATION_HANDLERS = {
+        # Incoming call (or existing call is ringing)
+        'ring': lambda self, line, lines: self._handleIncomingCall(lines),
+        'cring': lambda self, line, lines: self._handleIncomingCall(lines),
+        # New SMS message indication
+        'cmti': lambda self, line, lines: self._handleSmsReceived(line),
+        # USSD notification - either a response or a MT-USSD ("push USSD") message
+        'cusd': lambda self, line, lines: self._handleUssd(lines),
+        # SMS status report
+        'cdsi': lambda self, line, lines: self._handleSmsStatusReport(line),
+        # Network registration status changed
+        'creg': lambda self, line, lines: self._handleNetworkRegistration(line),
+        # New incoming DTMF
+        'dtmf': lambda self, line, lines: self._handleIncomingDTMF(line)}
+    # Time (in seconds) an idle extra notification handler thread waits for another notification before exiting
+    NOTIFICATION_WORKER_IDLE_TIMEOUT = 1
+    # Maximum number of handled SMS messages to keep in storage while waiting for further queued +CMTI notifications
+    MAX_PENDING_SMS_DELETES = 10
+    # Maximum age (in seconds) of a cached signal strength reading returned by the signalStrength property
+    signalStrengthMaxAge = 0.5
+    # Pre-bound match methods for the regexes used on the command/notification hot paths
+    _cmErrorMatch = CM_ERROR_REGEX.match
+    _csqMatch = CSQ_REGEX.match
+    _clipMatch = CLIP_REGEX.match
+    _cmtiMatch = CMTI_REGEX.match
+    _cdsiMatch = CDSI_REGEX.match
+    _cdsMatch = CDS_REGEX.match
+    _urcMatch = URC_REGEX.match
+    _cregUrcMatch = CREG_URC_REGEX.match
 
     def __init__(self, port, baudrate=115200, incomingCallCallbackFunc=None, smsReceivedCallbackFunc=None, smsStatusReportCallback=None, requestDelivery=True, AT_CNMI="", *a, **kw):
         super(GsmModem, self).__init__(port, baudrate, notifyCallbackFunc=self._handleModemNotification, *a, **kw)
-        self.incomingCallCallback = incomingCallCallbackFunc or self._placeholderCallback
-        self.smsReceivedCallback = smsReceivedCallbackFunc or self._placeholderCallback
-        self.smsStatusReportCallback = smsStatusReportCallback or self._placeholderCallback
+        self.incomingCallCallback = incomingCallCallbackFunc or _NOOP
+        self.smsReceivedCallback = smsReceivedCallbackFunc or _NOOP
+        self.smsStatusReportCallback = smsStatusReportCallback or _NOOP
         self.requestDelivery = requestDelivery
         self.AT_CNMI = AT_CNMI or "2,1,0,2"
         # Flag indicating whether caller ID for incoming call notification has been set up
@@ -159,6 +198,7 @@ class GsmModem(SerialComms):
         # Flag indicating whether incoming call notifications have extended information
         self._extendedIncomingCallIndication = False
         # Current active calls (ringing and/or answered), key is the unique call ID (not the remote number)
+        # Calls are removed from this dict by Call.hangup(), or when the modem reports that the call has ended
         self.activeCalls = {}
         # Dict containing sent SMS messages (for auto-tracking their delivery status)
         self.sentSms = weakref.WeakValueDictionary()
@@ -166,6 +206,7 @@ class GsmModem(SerialComms):
         self._ussdResponse = None # gsmmodem.modem.Ussd
         self._smsStatusReportEvent = None # threading.Event
         self._dialEvent = None # threading.Event
+        self._cregEvent = None # threading.Event
         self._dialResponse = None # gsmmodem.modem.Call
         self._waitForAtdResponse = True # Flag that controls if we should wait for an immediate response to ATD, or not
         self._waitForCallInitUpdate = True # Flag that controls if we should wait for a ATD "call initiated" message
@@ -183,6 +224,13 @@ class GsmModem(SerialComms):
         self._smsEncoding = 'GSM' # Default SMS encoding
         self._smsSupportedEncodingNames = None # List of available encoding names
         self._commands = None # List of supported AT commands
+        self._signalStrengthCache = None # (time.monotonic() timestamp, value) of the last signal strength reading
+        self._notificationQueue = None # queue.Queue of unsolicited notifications waiting to be handled
+        self._notificationWorkers = [] # Threads currently handling unsolicited notifications (see _handleModemNotification())
+        self._notificationsActive = 0 # Number of notifications queued or currently being handled
+        self._smsNotificationsActive = 0 # Number of +CMTI notifications queued or currently being handled (see _handleSmsReceived())
+        self._pendingSmsDeletes = [] # (memory, index) tuples of received SMS messages waiting to be deleted
+        self._notificationLock = threading.Lock() # Protects _notificationWorkers, the notification counters and _pendingSmsDeletes
         #Pool of detected DTMF
         self.dtmfpool = []
 
@@ -196,7 +244,14 @@ class GsmModem(SerialComms):
         :raise IncorrectPinError: if the specified PIN is incorrect
         """
         self.log.info('Connecting to modem on port %s at %dbps', self.port, self.baudrate)
+        self._signalStrengthCache = None
+        self._notificationQueue = queue.Queue()
         super(GsmModem, self).connect()
+        # Notification handler thread that stays alive until close() is called; more are started when needed
+        worker = threading.Thread(target=self._notificationLoop, args=(self._notificationQueue, True))
+        with self._notificationLock:
+            self._notificationWorkers = [worker]
+        worker.start()
 
         if waitingForModemToStartInSeconds > 0:
             while waitingForModemToStartInSeconds > 0:
@@ -219,7 +274,8 @@ class GsmModem(SerialComms):
             self.write('ATZ') # reset configuration
         else:
             pinCheckComplete = False
-        self.write('ATE0') # echo off
+        # Echo off, and enable detailed error messages (even if it has already been set - ATZ may reset this)
+        self.writeBatch(['ATE0', 'AT+CMEE=1'])
         try:
             cfun = lineStartingWith('+CFUN:', self.write('AT+CFUN?'))[7:] # example response: +CFUN: 1 or +CFUN: 1,0
             cfun = int(cfun.split(",")[0])
@@ -228,7 +284,6 @@ class GsmModem(SerialComms):
         except CommandError:
             pass # just ignore if the +CFUN command isn't supported
 
-        self.write('AT+CMEE=1') # enable detailed error messages (even if it has already been set - ATZ may reset this)
         if not pinCheckComplete:
             self._unlockSim(pin)
 
@@ -399,20 +454,40 @@ class GsmModem(SerialComms):
             self.write('AT+CLIP=1') # Enable calling line identification presentation
         except CommandError as clipError:
             self._callingLineIdentification = False
-            self.log.warning('Incoming call calling line identification (caller ID) not supported by modem. Error: {0}'.format(clipError))
+            self.log.warning('Incoming call calling line identification (caller ID) not supported by modem. Error: %s', clipError)
         else:
             self._callingLineIdentification = True
             try:
                 self.write('AT+CRC=1') # Enable extended format of incoming indication (optional)
             except CommandError as crcError:
                 self._extendedIncomingCallIndication = False
-                self.log.warning('Extended format incoming call indication not supported by modem. Error: {0}'.format(crcError))
+                self.log.warning('Extended format incoming call indication not supported by modem. Error: %s', crcError)
             else:
                 self._extendedIncomingCallIndication = True
 
         # Call control setup
         self.write('AT+CVHU=0', parseError=False) # Enable call hang-up with ATH command (ignore if command not supported)
 
+    def close(self):
+        """ Stops the read thread and notification handler threads, and closes the underlying serial port """
+        if self.alive and len(self._pendingSmsDeletes) > 0:
+            try:
+                self._deletePendingSms()
+            except (CommandError, TimeoutException):
+                self.log.warning('Failed to delete received SMS messages before closing', exc_info=True)
+        super(GsmModem, self).close()
+        if self._notificationQueue != None:
+            # Tell the notification handler threads to exit once they are done with any queued notifications
+            with self._notificationLock:
+                workers = self._notificationWorkers
+                for worker in workers:
+                    self._notificationQueue.put(None)
+                self._notificationQueue = None
+                self._notificationWorkers = []
+            for worker in workers:
+                if worker is not threading.current_thread(): # close() may be called from a callback
+                    worker.join()
+
     def _unlockSim(self, pin):
         """ Unlocks the SIM card using the specified PIN (if necessary, else does nothing) """
         # Unlock the SIM card if needed
@@ -461,14 +536,16 @@ class GsmModem(SerialComms):
         """
 
         self.log.debug('write: %s', data)
-        responseLines = super(GsmModem, self).write(data + writeTerm, waitForResponse=waitForResponse, timeout=timeout, expectedResponseTermSeq=expectedResponseTermSeq)
+        responseLines = super(GsmModem, self).write((data + writeTerm).encode(), waitForResponse=waitForResponse, timeout=timeout, expectedResponseTermSeq=expectedResponseTermSeq)
         if self._writeWait > 0: # Sleep a bit if required (some older modems suffer under load)
             time.sleep(self._writeWait)
         if waitForResponse:
+            if len(responseLines) > 1:
+                responseLines = self._removeCregNotifications(responseLines)
             cmdStatusLine = responseLines[-1]
-            if parseError:
+            if parseError and cmdStatusLine != 'OK': # Most commands succeed; skip error checks for those
                 if 'ERROR' in cmdStatusLine:
-                    cmErrorMatch = self.CM_ERROR_REGEX.match(cmdStatusLine)
+                    cmErrorMatch = self._cmErrorMatch(cmdStatusLine)
                     if cmErrorMatch:
                         errorType = cmErrorMatch.group(1)
                         errorCode = int(cmErrorMatch.group(2))
@@ -496,19 +573,76 @@ class GsmModem(SerialComms):
                     raise CommandError('{} ({})'.format(data,cmdStatusLine))
             return responseLines
 
+    def _removeCregNotifications(self, responseLines):
+        """ Removes +CREG network registration notifications that arrived while waiting for a command's response
+
+        The notifications are handled as normal unsolicited notifications instead.
+
+        :return: The response lines without any +CREG notifications
+        :rtype: list
+        """
+        cregLines = [line for line in responseLines if line.startswith('+CREG:') and self._cregUrcMatch(line)]
+        if len(cregLines) == 0:
+            return responseLines
+        for line in cregLines:
+            self._handleModemNotification([line])
+        return [line for line in responseLines if line not in cregLines]
+
+    def writeBatch(self, commands, timeout=10, parseError=True):
+        """ Write several AT commands to the modem on a single command line, e.g. ``ATE0;+CMEE=1``
+
+        This saves a round trip per command. If the modem rejects the combined command line,
+        the commands are written one at a time instead, so that an error is isolated to the
+        command that caused it. Commands on the combined line that ran before the failing one
+        are then executed a second time, so only idempotent commands may be batched.
+
+        Do not include commands that end command line processing (such as ATZ or ATD) or
+        commands whose response needs to be parsed.
+
+        :param commands: The AT commands to write (each including its AT prefix)
+        :type commands: list
+        :param timeout: Maximum amount of time in seconds to wait for a response from the modem (per command line)
+        :type timeout: int
+        :param parseError: If True, a CommandError is raised if one of the commands fails
+        :type parseError: bool
+
+        :raise CommandError: if a command returns an error (only if parseError parameter is True)
+        :raise TimeoutException: if no response to a command was received from the modem
+
+        :return: A list containing the response lines from the modem for the last command line written, or an empty list if no commands were specified
+        :rtype: list
+        """
+        if len(commands) < 2:
+            return self.write(commands[0], timeout=timeout, parseError=parseError) if len(commands) == 1 else []
+        response = self.write('AT' + ';'.join(removeAtPrefix(command) for command in commands), timeout=timeout, parseError=False)
+        if response[-1] == 'OK':
+            return response
+        self.log.debug('Combined command line failed; writing commands separately: %s', commands)
+        for command in commands:
+            response = self.write(command, timeout=timeout, parseError=parseError)
+        return response
+
     @property
     def signalStrength(self):
         """ Checks the modem's cellular network signal strength
 
+        Readings are cached for signalStrengthMaxAge seconds, so callers polling faster
+        than that do not query the modem every time.
+
         :raise CommandError: if an error occurs
 
         :return: The network signal strength as an integer between 0 and 99, or -1 if it is unknown
         :rtype: int
         """
-        csq = self.CSQ_REGEX.match(self.write('AT+CSQ')[0])
+        cache = self._signalStrengthCache
+        if cache != None and time.monotonic() - cache[0] < self.signalStrengthMaxAge:
+            return cache[1]
+        csq = self._csqMatch(self.write('AT+CSQ')[0])
         if csq:
             ss = int(csq.group(1))
-            return ss if ss != 99 else -1
+            ss = ss if ss != 99 else -1
+            self._signalStrengthCache = (time.monotonic(), ss)
+            return ss
         else:
             raise CommandError()
 
@@ -562,7 +696,7 @@ class GsmModem(SerialComms):
             elif len(response) > 2: # Multi-line response
                 return [removeAtPrefix(cmd.strip()) for cmd in response[:-1]]
             else:
-                self.log.debug('Unhandled +CLAC response: {0}'.format(response))
+                self.log.debug('Unhandled +CLAC response: %s', response)
                 return None
         except (TimeoutException, CommandError):
             # Try interactive command recognition
@@ -628,7 +762,7 @@ class GsmModem(SerialComms):
 
         # Check response length (should be 2 - list of options and command status)
         if len(response) != 2:
-            self.log.debug('Unhandled +CSCS response: {0}'.format(response))
+            self.log.debug('Unhandled +CSCS response: %s', response)
             self._smsSupportedEncodingNames = []
             raise NotImplementedError
 
@@ -642,7 +776,7 @@ class GsmModem(SerialComms):
             enc_list = enc_list.split(',')
             enc_list = [x.split('"')[1] for x in enc_list]
         except:
-            self.log.debug('Unhandled +CSCS response: {0}'.format(response))
+            self.log.debug('Unhandled +CSCS response: %s', response)
             self._smsSupportedEncodingNames = []
             raise NotImplementedError
 
@@ -668,9 +802,9 @@ class GsmModem(SerialComms):
                     if len(encoding) == 3:
                         self._smsEncoding = encoding[1]
                     else:
-                        self.log.debug('Unhandled +CSCS response: {0}'.format(response))
+                        self.log.debug('Unhandled +CSCS response: %s', response)
             else:
-                self.log.debug('Unhandled +CSCS response: {0}'.format(response))
+                self.log.debug('Unhandled +CSCS response: %s', response)
 
         return self._smsEncoding
     @smsEncoding.setter
@@ -729,8 +863,7 @@ class GsmModem(SerialComms):
     def _compileSmsRegexes(self):
         """ Compiles regular expression used for parsing SMS messages based on current mode """
         if self.smsTextMode:
-            if self.CMGR_SM_DELIVER_REGEX_TEXT == None:
-                self.CMGR_SM_DELIVER_REGEX_TEXT = re.compile('^\+CMGR: "([^"]+)","([^"]+)",[^,]*,"([^"]+)"$')
+            if self.CMGR_SM_REPORT_REGEXT_TEXT == None:
                 self.CMGR_SM_REPORT_REGEXT_TEXT = re.compile('^\+CMGR: ([^,]*),\d+,(\d+),"{0,1}([^"]*)"{0,1},\d*,"([^"]+)","([^"]+)",(\d+)$')
         elif self.CMGR_REGEX_PDU == None:
             self.CMGR_REGEX_PDU = re.compile('^\+CMGR:\s*(\d*),\s*"{0,1}([^"]*)"{0,1},\s*(\d+)$')
@@ -797,13 +930,13 @@ class GsmModem(SerialComms):
                 response = self.write('AT+CPBS?')
                 selected_phonebook = response[0][6:].split('"')[1] # first line, remove the +CSCS: prefix, split, first parameter
 
-                if selected_phonebook is not "ON":
+                if selected_phonebook != "ON":
                     self.write('AT+CPBS="ON"')
 
                 response = self.write("AT+CPBR=1")
                 self.write('AT+CPBS="{0}"'.format(selected_phonebook))
 
-            if response is "OK": # command is supported, but no number is set
+            if response == ["OK"]: # command is supported, but no number is set
                 return None
             elif len(response) == 2: # OK and phone number. Actual number is in the first line, second parameter, and is placed inside quotation marks
                 cnumLine = response[0]
@@ -811,10 +944,10 @@ class GsmModem(SerialComms):
                 if cnumMatch:
                     return cnumMatch.group(1)
                 else:
-                    self.log.debug('Error parse +CNUM response: {0}'.format(response))
+                    self.log.debug('Error parse +CNUM response: %s', response)
                     return None
             elif len(response) > 2: # Multi-line response
-                self.log.debug('Unhandled +CNUM/+CPBS response: {0}'.format(response))
+                self.log.debug('Unhandled +CNUM/+CPBS response: %s', response)
                 return None
 
         except (TimeoutException, CommandError):
@@ -822,8 +955,9 @@ class GsmModem(SerialComms):
 
     @ownNumber.setter
     def ownNumber(self, phone_number):
-        actual_phonebook = self.write('AT+CPBS?')
-        if actual_phonebook is not "ON":
+        response = self.write('AT+CPBS?')
+        actual_phonebook = response[0][6:].split('"')[1] # first line, remove the +CPBS: prefix, split, first parameter
+        if actual_phonebook != "ON":
             self.write('AT+CPBS="ON"')
         self.write('AT+CPBW=1,"' + phone_number + '"')
 
@@ -833,7 +967,12 @@ class GsmModem(SerialComms):
 
         This method blocks until the modem is registered with the network
         and the signal strength is greater than 0, optionally timing out
-        if a timeout was specified
+        if a timeout was specified.
+
+        Between checks, this waits for a +CREG network registration notification
+        from the modem, re-checking at least every second for modems that do not send
+        these notifications. If they are disabled (AT+CREG=0), the notifications are
+        enabled only while this method runs.
 
         :param timeout: Maximum time to wait for network coverage, in seconds
         :type timeout: int or float
@@ -843,41 +982,52 @@ class GsmModem(SerialComms):
 
         :return: the current signal strength
         """
-        block = [True]
-        if timeout != None:
-            # Set up a timeout mechanism
-            def _cancelBlock():
-                block[0] = False
-            t = threading.Timer(timeout, _cancelBlock)
-            t.start()
+        deadline = time.time() + timeout if timeout != None else None
         ss = -1
         checkCreg = True
-        while block[0]:
-            if checkCreg:
-                cregResult = lineMatching('^\+CREG:\s*(\d),(\d)(,[^,]*,[^,]*)?$', self.write('AT+CREG?', parseError=False)) # example result: +CREG: 0,1
-                if cregResult:
-                    status = int(cregResult.group(2))
-                    if status in (1, 5):
-                        # 1: registered, home network, 5: registered, roaming
-                        # Now simply check and return network signal strength
+        cregEnabled = False # Whether network registration status change notifications were enabled here
+        self._cregEvent = threading.Event()
+        try:
+            while True:
+                if checkCreg:
+                    cregResult = lineMatching('^\+CREG:\s*(\d),(\d)(,[^,]*,[^,]*)?$', self.write('AT+CREG?', parseError=False)) # example result: +CREG: 0,1
+                    if cregResult:
+                        if not cregEnabled and cregResult.group(1) == '0':
+                            # Enable network registration status change notifications while waiting (ignore if not supported)
+                            self.write('AT+CREG=1', parseError=False)
+                            cregEnabled = True
+                        status = int(cregResult.group(2))
+                        if status in (1, 5):
+                            # 1: registered, home network, 5: registered, roaming
+                            # Now simply check and return network signal strength
+                            checkCreg = False
+                        elif status == 3:
+                            raise InvalidStateException('Network registration denied')
+                        elif status == 0:
+                            raise InvalidStateException('Device not searching for network operator')
+                    else:
+                        # Disable network registration check; only use signal strength
+                        self.log.info('+CREG check disabled due to invalid response or unsupported command')
                         checkCreg = False
-                    elif status == 3:
-                        raise InvalidStateException('Network registration denied')
-                    elif status == 0:
-                        raise InvalidStateException('Device not searching for network operator')
                 else:
-                    # Disable network registration check; only use signal strength
-                    self.log.info('+CREG check disabled due to invalid response or unsupported command')
-                    checkCreg = False
-            else:
-                # Check signal strength
-                ss = self.signalStrength
-                if ss > 0:
-                    return ss
-            time.sleep(1)
-        else:
-            # If this is reached, the timer task has triggered
-            raise TimeoutException()
+                    # Check signal strength
+                    ss = self.signalStrength
+                    if ss > 0:
+                        return ss
+                waitTime = 1 if deadline == None else min(1, deadline - time.time())
+                if waitTime > 0 and self._cregEvent.wait(waitTime):
+                    # Network registration status changed - check it again
+                    self._cregEvent.clear()
+                    checkCreg = True
+                if deadline != None and time.time() >= deadline:
+                    raise TimeoutException()
+        finally:
+            self._cregEvent = None
+            if cregEnabled:
+                try:
+                    self.write('AT+CREG=0', parseError=False)
+                except TimeoutException:
+                    self.log.warning('Failed to disable network registration status change notifications')
 
     def sendSms(self, destination, text, waitForDeliveryReport=False, deliveryTimeout=15, sendFlash=False):
         """ Send an SMS text message
@@ -904,7 +1054,7 @@ class GsmModem(SerialComms):
 
         if self.smsTextMode:
             # Send SMS via AT commands
-            self.write('AT+CMGS="{0}"'.format(destination), timeout=5, expectedResponseTermSeq='> ')
+            self.write(_cmgsTextHeader(destination), timeout=5, expectedResponseTermSeq='> ')
             result = lineStartingWith('+CMGS:', self.write(text, timeout=35, writeTerm=CTRLZ))
         else:
             # Check encoding
@@ -997,7 +1147,7 @@ class GsmModem(SerialComms):
             queryResponse = self.write('AT+CCFC={0},2'.format(querytype), timeout=responseTimeout) # Should respond with "OK"
         except Exception:
             raise
-        print(queryResponse)
+        self.log.debug('+CCFC response: %s', queryResponse)
         return True
 
 
@@ -1015,7 +1165,7 @@ class GsmModem(SerialComms):
         except Exception:
             raise
             return False
-        print(queryResponse)
+        self.log.debug('+CCFC response: %s', queryResponse)
         return queryResponse
 
     def dial(self, number, timeout=5, callStatusUpdateCallbackFunc=None):
@@ -1174,40 +1324,73 @@ class GsmModem(SerialComms):
     def _handleModemNotification(self, lines):
         """ Handler for unsolicited notifications from the modem
 
-        This method simply spawns a separate thread to handle the actual notification
-        (in order to release the read thread so that the handlers are able to write back to the modem, etc)
+        This method simply queues the notification for one of the notification handler threads
+        (in order to release the read thread so that the handlers are able to write back to the modem, etc).
+        A new handler thread is started if all running ones are busy, since a handler may block
+        waiting for another notification (e.g. a delivery report for an SMS sent from a callback).
 
         :param lines The lines that were read
         """
-        threading.Thread(target=self.__threadedHandleModemNotification, kwargs={'lines': lines}).start()
+        with self._notificationLock:
+            self._notificationQueue.put(lines)
+            self._notificationsActive += 1
+            if lines[0].startswith('+CMTI'):
+                self._smsNotificationsActive += 1
+            if self._notificationsActive > len(self._notificationWorkers):
+                worker = threading.Thread(target=self._notificationLoop, args=(self._notificationQueue,))
+                self._notificationWorkers.append(worker)
+                worker.start()
+
+    def _notificationLoop(self, notificationQueue, persistent=False):
+        """ Notification handler thread main loop
+
+        Handles queued unsolicited notifications until a None item is read from the queue.
+        Extra (non-persistent) handler threads also exit once no notification has been queued for
+        NOTIFICATION_WORKER_IDLE_TIMEOUT seconds. The persistent handler thread instead exits once
+        the main thread has finished, so that it does not keep the process alive if close() is never called.
+
+        :param notificationQueue: The queue of notifications to handle
+        :param persistent: Whether this thread should keep running while idle
+        """
+        while True:
+            try:
+                lines = notificationQueue.get(timeout=self.NOTIFICATION_WORKER_IDLE_TIMEOUT)
+            except queue.Empty:
+                with self._notificationLock:
+                    if not notificationQueue.empty():
+                        continue # A notification was queued just now
+                    if persistent and threading.main_thread().is_alive():
+                        continue
+                    if threading.current_thread() in self._notificationWorkers:
+                        self._notificationWorkers.remove(threading.current_thread())
+                    break
+            if lines == None:
+                break
+            try:
+                self.__threadedHandleModemNotification(lines)
+            except Exception:
+                self.log.error('error while handling modem notification: %s', lines, exc_info=True)
+            with self._notificationLock:
+                self._notificationsActive -= 1
 
     def __threadedHandleModemNotification(self, lines):
-        """ Implementation of _handleModemNotification() to be run in a separate thread
+        """ Implementation of _handleModemNotification() to be run in a notification handler thread
 
         :param lines The lines that were read
         """
         next_line_is_te_statusreport = False
         for line in lines:
-            if 'RING' in line:
-                # Incoming call (or existing call is ringing)
-                self._handleIncomingCall(lines)
-                return
-            elif line.startswith('+CMTI'):
-                # New SMS message indication
-                self._handleSmsReceived(line)
-                return
-            elif line.startswith('+CUSD'):
-                # USSD notification - either a response or a MT-USSD ("push USSD") message
-                self._handleUssd(lines)
-                return
-            elif line.startswith('+CDSI'):
-                # SMS status report
-                self._handleSmsStatusReport(line)
+            # Notification type, e.g. "cmti" for "+CMTI: "SM",1" or "ring" for "RING"
+            urcMatch = self._urcMatch(line)
+            urcType = urcMatch.lastgroup if urcMatch else None
+            handler = self._NOTIFICATION_HANDLERS.get(urcType)
+            if handler != None:
+                handler(self, line, lines)
                 return
-            elif line.startswith('+CDS'):
+            elif urcType == 'cds':
                 # SMS status report at next line
                 next_line_is_te_statusreport = True
-                cdsMatch = self.CDS_REGEX.match(line)
+                cdsMatch = self._cdsMatch(line)
                 if cdsMatch:
                     next_line_is_te_statusreport_length = int(cdsMatch.group(1))
                 else:
@@ -1215,10 +1398,6 @@ class GsmModem(SerialComms):
             elif next_line_is_te_statusreport:
                 self._handleSmsStatusReportTe(next_line_is_te_statusreport_length, line)
                 return
-            elif line.startswith('+DTMF'):
-                # New incoming DTMF
-                self._handleIncomingDTMF(line)
-                return
             else:
                 # Check for call status updates
                 for updateRegex, handlerFunc in self._callStatusUpdates:
@@ -1230,6 +1409,15 @@ class GsmModem(SerialComms):
         # If this is reached, the notification wasn't handled
         self.log.debug('Unhandled unsolicited modem notification: %s', lines)
 
+    def _handleNetworkRegistration(self, line):
+        """ Handler for +CREG network registration status notifications """
+        self.log.debug('Network registration status changed: %s', line)
+        self._signalStrengthCache = None
+        cregEvent = self._cregEvent # May be reset by waitForNetworkCoverage() in another thread
+        if cregEvent:
+            # A waitForNetworkCoverage() call is waiting for this - notify waiting thread
+            cregEvent.set()
+
     #Simcom modem able detect incoming DTMF
     def _handleIncomingDTMF(self,line):
         self.log.debug('Handling incoming DTMF')
@@ -1237,9 +1425,9 @@ class GsmModem(SerialComms):
         try:
             dtmf_num=line.split(':')[1].replace(" ","")
             self.dtmfpool.append(dtmf_num)
-            self.log.debug('DTMF number is {0}'.format(dtmf_num))
+            self.log.debug('DTMF number is %s', dtmf_num)
         except:
-            self.log.debug('Error parse DTMF number on line {0}'.format(line))
+            self.log.debug('Error parse DTMF number on line %s', line)
     def GetIncomingDTMF(self):
         if (len(self.dtmfpool)==0):
             return None
@@ -1248,7 +1436,7 @@ class GsmModem(SerialComms):
 
     def _handleIncomingCall(self, lines):
         self.log.debug('Handling incoming call')
-        ringLine = lines.pop(0)
+        ringLine = lines[0]
         if self._extendedIncomingCallIndication:
             try:
                 callType = ringLine.split(' ', 1)[1]
@@ -1264,12 +1452,11 @@ class GsmModem(SerialComms):
                     self._extendedIncomingCallIndication = False
         else:
             callType = None
-        if self._callingLineIdentification and len(lines) > 0:
-            clipLine = lines.pop(0)
-            clipMatch = self.CLIP_REGEX.match(clipLine)
-            if clipMatch:
-                callerNumber = '+' + clipMatch.group(1)
-                ton = clipMatch.group(2)
+        if self._callingLineIdentification and len(lines) > 1:
+            clip = self._parseClip(lines[1])
+            if clip:
+                callerNumber = '+' + clip[0]
+                ton = clip[1]
                 #TODO: re-add support for this
                 callerName = None
                 #callerName = clipMatch.group(3)
@@ -1311,16 +1498,15 @@ class GsmModem(SerialComms):
             groups = regexMatch.groups()
             if len(groups) > 1:
                 callId = int(groups[0])
-                self.activeCalls[callId].answered = True
             else:
                 # Call ID not available for this notificition - check for the first outgoing call that has not been answered
                 for call in dictValuesIter(self.activeCalls):
                     if call.answered == False and type(call) == Call:
                         call.answered = True
                         return
-        else:
-            # Use supplied values
-            self.activeCalls[callId].answered = True
+        call = self.activeCalls.get(callId)
+        if call != None:
+            call.answered = True
 
     def _handleCallEnded(self, regexMatch, callId=None, filterUnanswered=False):
         if regexMatch:
@@ -1334,10 +1520,10 @@ class GsmModem(SerialComms):
                         if not filterUnanswered or (filterUnanswered == True and call.answered == False):
                             callId = call.id
                             break
-        if callId and callId in self.activeCalls:
-            self.activeCalls[callId].answered = False
-            self.activeCalls[callId].active = False
-            del self.activeCalls[callId]
+        call = self.activeCalls.pop(callId, None) if callId else None
+        if call != None:
+            call.answered = False
+            call.active = False
 
     def _handleCallRejected(self, regexMatch, callId=None):
         """ Handler for rejected (unanswered calls being ended)
@@ -1350,23 +1536,39 @@ class GsmModem(SerialComms):
     def _handleSmsReceived(self, notificationLine):
         """ Handler for "new SMS" unsolicited notification line """
         self.log.debug('SMS message received')
-        if self.smsReceivedCallback is not None:
-            cmtiMatch = self.CMTI_REGEX.match(notificationLine)
-            if cmtiMatch:
-                msgMemory = cmtiMatch.group(1)
-                msgIndex = cmtiMatch.group(2)
-                sms = self.readStoredSms(msgIndex, msgMemory)
+        received = None # (memory, index) of the handled message, if it should be deleted
+        try:
+            if self.smsReceivedCallback is not None:
+                cmti = self._parseCmti(notificationLine)
+                if cmti:
+                    msgMemory, msgIndex = cmti
+                    sms = self.readStoredSms(msgIndex, msgMemory)
+                    try:
+                        self.smsReceivedCallback(sms)
+                    except Exception:
+                        self.log.error('error in smsReceivedCallback', exc_info=True)
+                    else:
+                        received = cmti
+        finally:
+            # Messages received in a burst are deleted together once no further +CMTI notifications are queued.
+            # This notification stops being counted in the same locked section, so that the last one always deletes.
+            with self._notificationLock:
+                if self._smsNotificationsActive > 0:
+                    self._smsNotificationsActive -= 1
+                if received != None:
+                    self._pendingSmsDeletes.append(received)
+                deletePending = len(self._pendingSmsDeletes) > 0 and \
+                    (self._smsNotificationsActive == 0 or len(self._pendingSmsDeletes) >= self.MAX_PENDING_SMS_DELETES)
+            if deletePending:
                 try:
-                    self.smsReceivedCallback(sms)
-                except Exception:
-                    self.log.error('error in smsReceivedCallback', exc_info=True)
-                else:
-                    self.deleteStoredSms(msgIndex)
+                    self._deletePendingSms()
+                except (CommandError, TimeoutException):
+                    self.log.warning('Failed to delete received SMS messages; will retry later', exc_info=True)
 
     def _handleSmsStatusReport(self, notificationLine):
         """ Handler for SMS status reports """
         self.log.debug('SMS status report received')
-        cdsiMatch = self.CDSI_REGEX.match(notificationLine)
+        cdsiMatch = self._cdsiMatch(notificationLine)
         if cdsiMatch:
             msgMemory = cdsiMatch.group(1)
             msgIndex = cdsiMatch.group(2)
@@ -1410,6 +1612,73 @@ class GsmModem(SerialComms):
             except Exception:
                 self.log.error('error in smsStatusReportCallback', exc_info=True)
 
+    def _parseClip(self, clipLine):
+        """ Parses a +CLIP caller ID line, e.g.: +CLIP: "+27820001234",145,,,,0
+
+        Uses simple string splitting for the common format, and falls back to CLIP_REGEX otherwise.
+
+        :return: tuple of (number without leading "+", TON), or None if the line could not be parsed
+        :rtype: tuple
+        """
+        if clipLine.startswith('+CLIP:'):
+            fields = clipLine[6:].split(',', 2)
+            if len(fields) >= 2:
+                number = fields[0].strip()
+                if len(number) > 2 and number[0] == '"' and number[-1] == '"':
+                    number = number[1:-1]
+                    if number[:1] == '+':
+                        number = number[1:]
+                    if number.isdigit() and fields[1].isdigit():
+                        return number, fields[1]
+        clipMatch = self._clipMatch(clipLine)
+        if clipMatch:
+            return clipMatch.groups()
+        return None
+
+    def _parseCmti(self, cmtiLine):
+        """ Parses a +CMTI new SMS message indication line, e.g.: +CMTI: "SM",1
+
+        Uses simple string splitting for the common format, and falls back to CMTI_REGEX otherwise.
+
+        :return: tuple of (memory, index), or None if the line could not be parsed
+        :rtype: tuple
+        """
+        if cmtiLine.startswith('+CMTI:'):
+            memory, sep, index = cmtiLine[6:].partition(',')
+            memory = memory.strip()
+            index = index.lstrip()
+            if len(memory) > 2 and memory[0] == '"' and memory[-1] == '"' and index.isdigit():
+                memory = memory[1:-1]
+                if '"' not in memory:
+                    return memory, index
+        cmtiMatch = self._cmtiMatch(cmtiLine)
+        if cmtiMatch:
+            return cmtiMatch.groups()
+        return None
+
+    def _parseCmgrDeliverText(self, cmgrLine):
+        """ Parses the header line of a text-mode +CMGR response for a received SMS message,
+        e.g.: +CMGR: "REC UNREAD","+27820001234",,"13/04/18,13:26:08+08"
+
+        The header is a fixed sequence of quoted fields, so it is split positionally instead of using a regex.
+
+        :return: tuple of (status, number, time), or None if the line could not be parsed
+        :rtype: tuple
+        """
+        if not cmgrLine.startswith('+CMGR: "') or cmgrLine[-1] != '"':
+            return None
+        fields = cmgrLine[8:-1].split('","', 1)
+        if len(fields) != 2:
+            return None
+        msgStatus = fields[0]
+        number, sep, rest = fields[1].partition('",')
+        # The optional <alpha> field may be empty or quoted; <scts> always starts after the last ',"'
+        msgTime = rest.rpartition(',"')[2]
+        if not sep or len(msgStatus) == 0 or len(number) == 0 or len(msgTime) == 0 \
+                or '"' in msgStatus or '"' in number or '"' in msgTime:
+            return None
+        return msgStatus, number, msgTime
+
     def readStoredSms(self, index, memory=None):
         """ Reads and returns the SMS message at the specified index
 
@@ -1428,10 +1697,11 @@ class GsmModem(SerialComms):
         msgData = self.write('AT+CMGR={0}'.format(index))
         # Parse meta information
         if self.smsTextMode:
-            cmgrMatch = self.CMGR_SM_DELIVER_REGEX_TEXT.match(msgData[0])
-            if cmgrMatch:
-                msgStatus, number, msgTime = cmgrMatch.groups()
-                msgText = '\n'.join(msgData[1:-1])
+            cmgr = self._parseCmgrDeliverText(msgData[0])
+            if cmgr:
+                msgStatus, number, msgTime = cmgr
+                # Most messages are a single line (header, text, OK); avoid the slice and join for those
+                msgText = msgData[1] if len(msgData) == 3 else '\n'.join(msgData[1:-1])
                 return ReceivedSms(self, Sms.TEXT_MODE_STATUS_MAP[msgStatus], number, parseTextModeTimeStr(msgTime), msgText)
             else:
                 # Try parsing status report
@@ -1479,6 +1749,36 @@ class GsmModem(SerialComms):
         # TODO: make a check how many params are supported by the modem and use the right command. For example, Siemens MC35, TC35 take only one parameter.
         #self.write('AT+CMGD={0}'.format(index))
 
+    def _deletePendingSms(self):
+        """ Deletes the received SMS messages queued for deletion by _handleSmsReceived()
+
+        Messages stored in the same memory are deleted using a single command line
+        (e.g. AT+CMGD=1,0;+CMGD=2,0) - see writeBatch(). Errors for individual messages are ignored.
+        If selecting the SMS memory fails or the modem stops responding, the messages that were
+        not deleted are queued for deletion again.
+
+        :raise CommandError: if the SMS memory to delete from could not be selected
+        :raise TimeoutException: if the modem did not respond to a delete command
+        """
+        with self._notificationLock:
+            pending = self._pendingSmsDeletes
+            self._pendingSmsDeletes = []
+        memories = []
+        indices = {}
+        for memory, index in pending:
+            if memory not in indices:
+                memories.append(memory)
+                indices[memory] = []
+            indices[memory].append(index)
+        for i, memory in enumerate(memories):
+            try:
+                self._setSmsMemory(readDelete=memory)
+                self.writeBatch(['AT+CMGD={0},0'.format(index) for index in indices[memory]], parseError=False)
+            except (CommandError, TimeoutException):
+                with self._notificationLock:
+                    self._pendingSmsDeletes[:0] = [(m, index) for m in memories[i:] for index in indices[m]]
+                raise
+
     def deleteMultipleStoredSms(self, delFlag=4, memory=None):
         """ Deletes all SMS messages that have the specified read status.
 
@@ -1546,10 +1846,6 @@ class GsmModem(SerialComms):
             message = cusdMatches[0].group(2)
         return Ussd(self, sessionActive, message)
 
-    def _placeHolderCallback(self, *args):
-        """ Does nothing """
-        self.log.debug('called with args: {0}'.format(args))
-
     def _pollCallStatus(self, expectedState, callId=None, timeout=None):
         """ Poll the status of outgoing calls.
         This is used for modems that do not have a known set of call status update notifications.
@@ -1603,6 +1899,9 @@ class Call(object):
 
     DTMF_COMMAND_BASE = '+VTS='
     dtmfSupport = False # Indicates whether or not DTMF tones can be sent in calls
+    # Cache of the AT commands built for recently sent DTMF tone strings; key is (DTMF command base, tones)
+    _dtmfCommandCache = {}
+    _DTMF_COMMAND_CACHE_SIZE = 64
 
     def __init__(self, gsmModem, callId, callType, number, callStatusUpdateCallbackFunc=None):
         """
@@ -1643,11 +1942,10 @@ class Call(object):
         :raise InvalidStateException: if the call has not been answered, or is ended while the command is still executing
         """
         if self.answered:
-            dtmfCommandBase = self.DTMF_COMMAND_BASE.format(cid=self.id)
             toneLen = len(tones)
-            for tone in list(tones):
+            for command in self._dtmfCommands(self.DTMF_COMMAND_BASE.format(cid=self.id), tones):
               try:
-                 self._gsmModem.write('AT{0}{1}'.format(dtmfCommandBase,tone), timeout=(5 + toneLen))
+                 self._gsmModem.write(command, timeout=(5 + toneLen))
 
               except CmeError as e:
                 if e.code == 30:
@@ -1661,6 +1959,18 @@ class Call(object):
         else:
             raise InvalidStateException('Call is not active (it has not yet been answered, or it has ended).')
 
+    @classmethod
+    def _dtmfCommands(cls, dtmfCommandBase, tones):
+        """ :return: the AT commands (one per tone) used for sending the specified DTMF tones, cached for repeated tone strings """
+        key = (dtmfCommandBase, tones)
+        commands = cls._dtmfCommandCache.get(key)
+        if commands == None:
+            if len(cls._dtmfCommandCache) >= cls._DTMF_COMMAND_CACHE_SIZE:
+                cls._dtmfCommandCache.clear()
+            commands = tuple('AT{0}{1}'.format(dtmfCommandBase, tone) for tone in tones)
+            cls._dtmfCommandCache[key] = commands
+        return commands
+
     def hangup(self):
         """ End the phone call.
 
@@ -1670,8 +1980,7 @@ class Call(object):
             self._gsmModem.write('ATH')
             self.answered = False
             self.active = False
-        if self.id in self._gsmModem.activeCalls:
-            del self._gsmModem.activeCalls[self.id]
+        self._gsmModem.activeCalls.pop(self.id, None)
 
 
 class IncomingCall(Call):
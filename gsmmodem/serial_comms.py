@@ -61,7 +61,7 @@ class SerialComms(object):
         self.rxThread.join()
         self.serial.close()
 
-    def _handleLineRead(self, line, checkForResponseTerm=True):
+    def _handleLineRead(self, line, checkForResponseTerm=True, moreLinesPending=False):
         #print 'sc.hlineread:',line
         if self._responseEvent and not self._responseEvent.is_set():
             # A response event has been set up (another thread is waiting for this response)
@@ -74,7 +74,7 @@ class SerialComms(object):
         else:
             # Nothing was waiting for this - treat it as a notification
             self._notification.append(line)
-            if self.serial.inWaiting() == 0:
+            if not moreLinesPending and self.serial.inWaiting() == 0:
                 # No more chars on the way for this notification - notify higher-level callback
                 #print 'notification:', self._notification
                 self.log.debug('notification: %s', self._notification)
@@ -91,21 +91,24 @@ class SerialComms(object):
         """
         try:
             readTermSeq = bytearray(self.RX_EOL_SEQ)
-            readTermLen = len(readTermSeq)
             rxBuffer = bytearray()
             while self.alive:
                 data = self.serial.read(1)
                 if len(data) != 0: # check for timeout
-                    #print >> sys.stderr, ' RX:', data,'({0})'.format(ord(data))
-                    rxBuffer.append(ord(data))
-                    if rxBuffer[-readTermLen:] == readTermSeq:
-                        # A line (or other logical segment) has been read
-                        line = rxBuffer[:-readTermLen].decode()
-                        rxBuffer = bytearray()
-                        if len(line) > 0:
-                            #print 'calling handler'
-                            self._handleLineRead(line)
-                    elif self._expectResponseTermSeq:
+                    # Fetch everything else that is already waiting in one go, instead of byte-by-byte
+                    waiting = self.serial.inWaiting()
+                    if waiting > 0:
+                        data += self.serial.read(waiting)
+                    rxBuffer.extend(data)
+                    if readTermSeq in rxBuffer:
+                        # One or more lines (or other logical segments) have been read
+                        lines = rxBuffer.split(readTermSeq)
+                        rxBuffer = lines.pop() # keep any incomplete trailing segment
+                        lines = [line.decode() for line in lines if len(line) > 0]
+                        lastLineIdx = len(lines) - 1
+                        for i, line in enumerate(lines):
+                            self._handleLineRead(line, moreLinesPending=(i < lastLineIdx or len(rxBuffer) > 0))
+                    if self._expectResponseTermSeq and len(rxBuffer) > 0:
                         if rxBuffer[-len(self._expectResponseTermSeq):] == self._expectResponseTermSeq:
                             line = rxBuffer.decode()
                             rxBuffer = bytearray()
@@ -122,7 +125,13 @@ class SerialComms(object):
             self.fatalErrorCallback(e)
 
     def write(self, data, waitForResponse=True, timeout=5, expectedResponseTermSeq=None):
-        data = data.encode()
+        """ Writes data to the device, optionally waiting for and returning the response
+
+        :param data: the data to write; str data is encoded first, bytes are written as-is
+        :type data: str or bytes
+        """
+        if not isinstance(data, bytes):
+            data = data.encode()
         with self._txLock:
             if waitForResponse:
                 if expectedResponseTermSeq:
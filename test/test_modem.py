@@ -5,7 +5,7 @@
 
 from __future__ import print_function
 
-import sys, time, unittest, logging, codecs
+import sys, time, unittest, logging, codecs, threading
 from datetime import datetime
 from copy import copy
 
@@ -70,7 +70,7 @@ class MockSerialPackage(object):
             
             if timeout != None:
                 time.sleep(0.001)
-                return ''
+                return b''
             else:
                 while self._alive:
                     if len(self.writeQueue) > 0:
@@ -88,7 +88,7 @@ class MockSerialPackage(object):
                         if len(self.responseSequence) > 0:                            
                             self._setupReadValue(command)                    
                     else:                        
-                        self._readQueue = list(value)
+                        self._readQueue = [c.encode() for c in value]
                 else:
                     self.responseSequence = self.modem.getResponse(command)
                     if len(self.responseSequence) > 0:
@@ -266,6 +266,7 @@ class TestGsmModemGeneralApi(unittest.TestCase):
         def writeCallbackFunc(data):
             self.assertEqual('AT+CSQ\r', data, 'Invalid data written to modem; expected "{0}", got: "{1}"'.format('AT+CSQ', data))
         self.modem.serial.writeCallbackFunc = writeCallbackFunc
+        self.modem.signalStrengthMaxAge = 0 # disable caching
         tests = (('+CSQ: 18,99', 18),
                  ('+CSQ:4,0', 4),
                  ('+CSQ: 99,99', -1))
@@ -281,6 +282,87 @@ class TestGsmModemGeneralApi(unittest.TestCase):
         else:
             self.fail('CommandError not raised on error condition')
 
+    def test_signalStrengthCached(self):
+        """ Tests that signal strength readings are cached for a short while """
+        writes = []
+        def writeCallbackFunc(data):
+            writes.append(data)
+            self.modem.serial.responseSequence = ['+CSQ: {0},99\r\n'.format(10 + len(writes)), 'OK\r\n']
+        self.modem.serial.writeCallbackFunc = writeCallbackFunc
+        self.modem.signalStrengthMaxAge = 0.3
+        self.assertEqual(11, self.modem.signalStrength)
+        self.assertEqual(11, self.modem.signalStrength)
+        self.assertEqual(1, len(writes))
+        time.sleep(0.3)
+        self.assertEqual(12, self.modem.signalStrength)
+        # A network registration change invalidates the cached value
+        self.modem._handleNetworkRegistration('+CREG: 1')
+        self.assertEqual(13, self.modem.signalStrength)
+        self.assertEqual(3, len(writes))
+
+    def test_notificationWorkers(self):
+        """ Tests the notification handler thread lifecycle """
+        self.modem.NOTIFICATION_WORKER_IDLE_TIMEOUT = 0.2
+        handled = []
+        release = threading.Event()
+        def handler(lines):
+            handled.append(lines)
+            if lines == ['last']:
+                release.set()
+            else:
+                # Block as if waiting for another notification
+                release.wait(5)
+        self.modem._GsmModem__threadedHandleModemNotification = handler
+        for i in range(5):
+            self.modem._handleModemNotification([str(i)])
+        self.modem._handleModemNotification(['last'])
+        # Busy handlers should not hold up the last notification
+        self.assertTrue(release.wait(1), 'Notification not handled while other handlers were busy')
+        while len(handled) < 6:
+            time.sleep(0.05)
+        # Idle extra handler threads exit by themselves, but the persistent one stays...
+        persistentWorker = self.modem._notificationWorkers[0]
+        time.sleep(0.5)
+        self.assertEqual([persistentWorker], self.modem._notificationWorkers)
+        self.assertTrue(persistentWorker.is_alive())
+        # ...and are reused for notifications arriving in quick succession
+        handled[:] = []
+        release.clear()
+        self.modem._handleModemNotification(['last'])
+        self.assertTrue(release.wait(1))
+        while self.modem._notificationsActive > 0:
+            time.sleep(0.01)
+        self.modem._handleModemNotification(['last'])
+        while len(handled) < 2:
+            time.sleep(0.05)
+        self.assertEqual([persistentWorker], self.modem._notificationWorkers)
+        # close() waits for notification handler threads to finish
+        release.clear()
+        blockingWorker = self.modem._notificationWorkers[0]
+        self.modem._handleModemNotification(['blocking'])
+        threading.Timer(0.2, release.set).start()
+        self.modem.close()
+        self.assertFalse(blockingWorker.is_alive())
+        self.assertEqual([['last'], ['last'], ['blocking']], handled)
+
+    def test_cregNotificationDuringResponse(self):
+        """ Tests that a +CREG notification arriving in the middle of a command's response is not returned as part of it """
+        self.modem._cregEvent = threading.Event()
+        def writeCallbackFunc(data):
+            self.modem.serial.responseSequence = ['+CREG: 1\r\n', '+CSQ: 18,99\r\n', '+CREG: 5,"00C3","A1B2"\r\n', 'OK\r\n']
+        self.modem.serial.writeCallbackFunc = writeCallbackFunc
+        self.assertEqual(['+CSQ: 18,99', 'OK'], self.modem.write('AT+CSQ'))
+        self.modem.signalStrengthMaxAge = 0
+        self.assertEqual(18, self.modem.signalStrength)
+        # The notification should still be handled
+        self.assertTrue(self.modem._cregEvent.wait(1))
+        # AT+CREG? responses are left alone
+        def writeCallbackFunc2(data):
+            self.modem.serial.responseSequence = ['+CREG: 0,1\r\n', 'OK\r\n']
+        self.modem.serial.writeCallbackFunc = writeCallbackFunc2
+        self.assertEqual(['+CREG: 0,1', 'OK'], self.modem.write('AT+CREG?'))
+        self.modem._cregEvent = None
+
     def test_waitForNetorkCoverageNoCreg(self):
         """ Tests waiting for network coverage (no AT+CREG support) """
         tests = ((82,),
@@ -332,6 +414,42 @@ class TestGsmModemGeneralApi(unittest.TestCase):
             self.modem.serial.responseSequence = ['+CREG: 0,1\r\n'.format(result), 'OK\r\n']
         self.modem.serial.writeCallbackFunc = writeCallbackFunc2
         self.assertRaises(TimeoutException, self.modem.waitForNetworkCoverage, timeout=1)
+
+    def test_waitForNetorkCoverageCregNotification(self):
+        """ Tests that a +CREG notification triggers an immediate network registration re-check """
+        items = iter(('0,2', '0,1', 82))
+        writes = []
+        def writeCallbackFunc(data):
+            writes.append(data)
+            if data == 'AT+CSQ\r':
+                self.modem.serial.responseSequence = ['+CSQ: {0},99\r\n'.format(next(items)), 'OK\r\n']
+            elif data == 'AT+CREG?\r':
+                cregStatus = next(items)
+                self.modem.serial.responseSequence = ['+CREG: {0}\r\n'.format(cregStatus), 'OK\r\n']
+                if cregStatus == '0,2':
+                    # Modem registers on the network shortly after the first status check
+                    threading.Timer(0.2, self.modem._handleModemNotification, [['+CREG: 1']]).start()
+        self.modem.serial.writeCallbackFunc = writeCallbackFunc
+        start = time.time()
+        self.assertEqual(82, self.modem.waitForNetworkCoverage(timeout=5))
+        # Without the notification, the status would have been polled twice (once per second) before reading the signal strength
+        self.assertLess(time.time() - start, 1.8)
+        # Notifications are only enabled while waiting
+        self.assertEqual(['AT+CREG?\r', 'AT+CREG=1\r'], writes[:2])
+        self.assertEqual('AT+CREG=0\r', writes[-1])
+
+    def test_waitForNetorkCoverageCregAlreadyEnabled(self):
+        """ Tests that waiting for network coverage leaves an existing AT+CREG notification setting alone """
+        writes = []
+        def writeCallbackFunc(data):
+            writes.append(data)
+            if data == 'AT+CSQ\r':
+                self.modem.serial.responseSequence = ['+CSQ: 47,99\r\n', 'OK\r\n']
+            elif data == 'AT+CREG?\r':
+                self.modem.serial.responseSequence = ['+CREG: 2,1,"00C3","A1B2"\r\n', 'OK\r\n']
+        self.modem.serial.writeCallbackFunc = writeCallbackFunc
+        self.assertEqual(47, self.modem.waitForNetworkCoverage(timeout=5))
+        self.assertEqual([], [data for data in writes if data.startswith('AT+CREG=')])
         
     def test_errorTypes(self):
         """ Tests error type detection- and handling by throwing random errors to commands """
@@ -396,6 +514,67 @@ class TestGsmModemGeneralApi(unittest.TestCase):
             self.modem.serial.responseSequence = ['{0}\r\n'.format(toWrite), 'OK\r\n']
             self.assertEqual(name, self.modem.smsSupportedEncoding)
 
+    def test_writeBatch(self):
+        """ Tests writing several commands on one command line, and falling back to separate commands """
+        written = []
+        self.modem.serial.writeCallbackFunc = written.append
+        self.modem.writeBatch(['ATE0', 'AT+CMEE=1'])
+        self.assertEqual(written, ['ATE0;+CMEE=1\r'])
+        # Modem rejects the combined command line
+        del written[:]
+        self.modem.serial.modem.responses['ATE0;+CMEE=1\r'] = ['ERROR\r\n']
+        self.modem.writeBatch(['ATE0', 'AT+CMEE=1'])
+        self.assertEqual(written, ['ATE0;+CMEE=1\r', 'ATE0\r', 'AT+CMEE=1\r'])
+        # Errors from separately-written commands are only raised if parseError is True
+        self.modem.serial.modem.responses['AT+CMEE=1\r'] = ['ERROR\r\n']
+        self.assertRaises(CommandError, self.modem.writeBatch, ['ATE0', 'AT+CMEE=1'])
+        self.assertEqual(self.modem.writeBatch(['ATE0', 'AT+CMEE=1'], parseError=False), ['ERROR'])
+        # A single command is written as-is, and no commands means nothing is written
+        del written[:]
+        self.assertEqual(self.modem.writeBatch(['AT+CMEE=1'], parseError=False), ['ERROR'])
+        self.assertEqual(self.modem.writeBatch([]), [])
+        self.assertEqual(written, ['AT+CMEE=1\r'])
+
+    def test_urcRegex(self):
+        """ Tests identifying unsolicited notification types with URC_REGEX """
+        tests = (('RING', 'ring'),
+                 ('+CRING: VOICE', 'cring'),
+                 ('+CMTI: "SM",1', 'cmti'),
+                 ('+CUSD: 0,"Available Balance: R 96.45 .",15', 'cusd'),
+                 ('+CDSI: "SM",3', 'cdsi'),
+                 ('+CDS: 24', 'cds'),
+                 ('+CREG: 1', 'creg'),
+                 ('+DTMF: 1', 'dtmf'),
+                 ('+CLIP: "+27820001234",145,,,,0', None),
+                 ('+CDSX: 1', None),
+                 ('RINGING', None))
+        for line, expected in tests:
+            match = self.modem.URC_REGEX.match(line)
+            self.assertEqual(match.lastgroup if match else None, expected, line)
+
+    def test_parseNotificationLines(self):
+        """ Tests the string-splitting +CLIP, +CMTI and +CMGR parsers (and their regex fallbacks) """
+        tests = (('+CLIP: "+27820001234",145,,,,0', ('27820001234', '145')),
+                 ('+CLIP: "27820001234",129', ('27820001234', '129')),
+                 ('+CLIP:"+27820001234",145x', ('27820001234', '145')),
+                 ('+CLIP: "",128,,,,2', None))
+        for line, expected in tests:
+            self.assertEqual(self.modem._parseClip(line), expected)
+        tests = (('+CMTI: "SM",1', ('SM', '1')),
+                 ('+CMTI: "ME", 23', ('ME', '23')),
+                 ('+CMTI: "SM",', None),
+                 ('+CMTI: SM,1', None))
+        for line, expected in tests:
+            self.assertEqual(self.modem._parseCmti(line), expected)
+        self.modem.smsTextMode = True
+        tests = (('+CMGR: "REC UNREAD","+27820001234",,"13/04/18,13:26:08+08"', ('REC UNREAD', '+27820001234', '13/04/18,13:26:08+08')),
+                 ('+CMGR: "REC READ","+27820001234","Some Name","13/04/18,13:26:08+08"', ('REC READ', '+27820001234', '13/04/18,13:26:08+08')),
+                 ('+CMGR: "REC READ","+27820001234","Name, Some","13/04/18,13:26:08+08"', ('REC READ', '+27820001234', '13/04/18,13:26:08+08')),
+                 ('+CMGR: "REC READ","+27820001234",,', None),
+                 ('+CMGR: "REC UNREAD",6,20,"+27820001234",145,"13/04/18,13:26:08+08","13/04/18,13:26:10+08",0', None))
+        for line, expected in tests:
+            self.assertEqual(self.modem._parseCmgrDeliverText(line), expected)
+
 
 class TestUssd(unittest.TestCase):
     """ Tests USSD session handling """
@@ -1237,7 +1416,11 @@ class TestIncomingCall(unittest.TestCase):
 
 class TestCall(unittest.TestCase):
     """ Tests Call object APIs that are not covered by TestIncomingCall and TestGsmModemDial """
-    
+
+    def setUp(self):
+        # The DTMF command cache is shared by all Call objects
+        gsmmodem.modem.Call._dtmfCommandCache.clear()
+
     def init_modem(self, modem):
         global FAKE_MODEM
         FAKE_MODEM = modem
@@ -1251,6 +1434,7 @@ class TestCall(unittest.TestCase):
         originalBaseDtmfCommand = gsmmodem.modem.Call.DTMF_COMMAND_BASE
         for fakeModem in fakemodems.createModems():
             gsmmodem.modem.Call.DTMF_COMMAND_BASE = originalBaseDtmfCommand
+            gsmmodem.modem.Call._dtmfCommandCache.clear()
             self.init_modem(fakeModem)
             # Make sure everything is set up correctly during connect()
             self.assertEqual(gsmmodem.modem.Call.DTMF_COMMAND_BASE, fakeModem.dtmfCommandBase, 'Invalid base DTMF command for modem: {0}; expected "{1}", got "{2}"'.format(fakeModem, fakeModem.dtmfCommandBase, gsmmodem.modem.Call.DTMF_COMMAND_BASE))
@@ -1269,6 +1453,18 @@ class TestCall(unittest.TestCase):
                     self.assertEqual(expectedCommand, data, 'Invalid data written to modem for tones: "{0}"; expected "{1}", got: "{2}". Modem: {3}'.format(tones, expectedCommand[:-1].format(cid=self.id), data[:-1] if data[-1] == '\r' else data, fakeModem))
                 self.modem.serial.writeCallbackFunc = writeCallbackFunc
                 self.currentTone = 0;
+                call.sendDtmfTone(tones)
+                self.assertEqual(self.currentTone, len(tones))
+                cacheKey = (fakeModem.dtmfCommandBase.format(cid=call.id), tones)
+                self.assertIn(cacheKey, gsmmodem.modem.Call._dtmfCommandCache)
+                cachedCommands = gsmmodem.modem.Call._dtmfCommandCache[cacheKey]
+                self.assertEqual(tuple('AT{0}{1}'.format(cacheKey[0], tone) for tone in tones), cachedCommands)
+                # Sending the same tones again uses the cached commands
+                self.currentTone = 0;
+                call.sendDtmfTone(tones)
+                self.assertEqual(self.currentTone, len(tones))
+                self.assertIs(cachedCommands, gsmmodem.modem.Call._dtmfCommandCache[cacheKey])
+            self.assertEqual(len(tests), len(gsmmodem.modem.Call._dtmfCommandCache))
             
             # Now attempt to send DTMF tones in an inactive call
             self.modem.serial.writeCallbackFunc = None
@@ -1614,7 +1810,108 @@ class TestSms(unittest.TestCase):
             while callbackInfo[0] == False:
                 time.sleep(0.1)
         self.modem.close()
-        
+
+    def test_receiveSmsBurstDeletedTogether(self):
+        """ Tests that SMS messages received in a burst are deleted using a single command line """
+        secondSmsReceived = threading.Event()
+        received = []
+        def smsReceivedCallbackFunc(sms):
+            received.append(sms.text)
+            if len(received) == 1:
+                # Keep handling the first message until the second one has been received
+                secondSmsReceived.wait(5)
+            else:
+                secondSmsReceived.set()
+
+        deleteCommands = []
+        def writeCallbackFunc(data):
+            if data.startswith('AT+CMGR='):
+                self.modem.serial.responseSequence = ['+CMGR: "REC UNREAD","+27820001234",,"13/04/18,13:26:08+08"\r\n', 'Message {0}\r\n'.format(data[8:-1]), 'OK\r\n']
+            elif data.startswith('AT+CMGD'):
+                deleteCommands.append(data)
+
+        self.initModem(smsReceivedCallbackFunc=smsReceivedCallbackFunc)
+        self.modem.smsTextMode = True
+        self.modem.serial.writeCallbackFunc = writeCallbackFunc
+        self.modem.serial.responseSequence = ['+CMTI: "SM",1\r\n']
+        while len(received) == 0:
+            time.sleep(0.05)
+        self.modem.serial.responseSequence = ['+CMTI: "SM",4\r\n']
+        while len(deleteCommands) == 0:
+            time.sleep(0.05)
+        time.sleep(0.1)
+        self.assertEqual(received, ['Message 1', 'Message 4'])
+        self.assertEqual(deleteCommands, ['AT+CMGD=4,0;+CMGD=1,0\r'])
+        self.modem.close()
+
+    def test_receiveSmsDeletedWhileOtherHandlerBusy(self):
+        """ Tests that a received SMS message is deleted while an unrelated notification is still being handled """
+        received = []
+        deleteCommands = []
+        def writeCallbackFunc(data):
+            if data.startswith('AT+CMGR='):
+                self.modem.serial.responseSequence = ['+CMGR: "REC UNREAD","+27820001234",,"13/04/18,13:26:08+08"\r\n', 'Message {0}\r\n'.format(data[8:-1]), 'OK\r\n']
+            elif data.startswith('AT+CMGD'):
+                deleteCommands.append(data)
+
+        self.initModem(smsReceivedCallbackFunc=lambda sms: received.append(sms.text))
+        self.modem.smsTextMode = True
+        callReleased = threading.Event()
+        self.modem.incomingCallCallback = lambda call: callReleased.wait(5)
+        self.modem.serial.writeCallbackFunc = writeCallbackFunc
+        self.modem.serial.responseSequence = ['RING\r\n']
+        time.sleep(0.2)
+        self.modem.serial.responseSequence = ['+CMTI: "SM",2\r\n']
+        start = time.time()
+        while len(deleteCommands) == 0 and time.time() - start < 2:
+            time.sleep(0.05)
+        callReleased.set()
+        self.assertEqual(received, ['Message 2'])
+        self.assertEqual(deleteCommands, ['AT+CMGD=2,0\r'])
+        self.modem.close()
+
+    def test_receiveSmsConcurrentHandlersDeleted(self):
+        """ Tests that the last of several concurrently handled +CMTI notifications deletes all the messages """
+        deleteCommands = []
+        def writeCallbackFunc(data):
+            if data.startswith('AT+CMGR='):
+                self.modem.serial.responseSequence = ['+CMGR: "REC UNREAD","+27820001234",,"13/04/18,13:26:08+08"\r\n', 'Message {0}\r\n'.format(data[8:-1]), 'OK\r\n']
+            elif data.startswith('AT+CMGD'):
+                deleteCommands.append(data)
+
+        self.initModem(smsReceivedCallbackFunc=lambda sms: None)
+        self.modem.smsTextMode = True
+        self.modem.serial.writeCallbackFunc = writeCallbackFunc
+        # Both notifications are counted while their handlers run, and each handler finishes before the other's thread moves on
+        self.modem._smsNotificationsActive = 2
+        self.modem._handleSmsReceived('+CMTI: "SM",1')
+        self.assertEqual([], deleteCommands)
+        self.modem._handleSmsReceived('+CMTI: "SM",2')
+        self.assertEqual(['AT+CMGD=1,0;+CMGD=2,0\r'], deleteCommands)
+        self.assertEqual([], self.modem._pendingSmsDeletes)
+        self.assertEqual(0, self.modem._smsNotificationsActive)
+        self.modem.close()
+
+    def test_deletePendingSmsTimeout(self):
+        """ Tests that SMS messages are queued for deletion again if the modem does not respond to the delete command """
+        self.initModem(None)
+        def write(*args, **kwargs):
+            raise TimeoutException()
+        self.modem.write = write
+        self.modem._pendingSmsDeletes = [('SM', '3'), ('ME', '1')]
+        self.assertRaises(TimeoutException, self.modem._deletePendingSms)
+        self.assertEqual([('SM', '3'), ('ME', '1')], self.modem._pendingSmsDeletes)
+        del self.modem.write
+        # Same if the SMS memory cannot be selected
+        def setSmsMemory(readDelete=None, write=None):
+            raise CmsError('AT+CPMS="ME"', 302)
+        self.modem._setSmsMemory = setSmsMemory
+        self.assertRaises(CmsError, self.modem._deletePendingSms)
+        self.assertEqual([('SM', '3'), ('ME', '1')], self.modem._pendingSmsDeletes)
+        del self.modem._setSmsMemory
+        self.modem._pendingSmsDeletes = []
+        self.modem.close()
+
     def test_receiveSmsPduMode(self):
         """ Tests receiving SMS messages in PDU mode """
         callbackInfo = [False, '', '', -1, None, '', None]
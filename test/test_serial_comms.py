@@ -45,7 +45,7 @@ class MockSerialPackage(object):
 #                time.sleep(min(timeout, self._REPONSE_TIME))                
 #                if timeout > self._REPONSE_TIME and len(self.writeQueue) == 0:
 #                    time.sleep(timeout - self._REPONSE_TIME)
-                return ''
+                return b''
             else:
                 while self._alive:
                     if len(self.writeQueue) > 0:
@@ -64,7 +64,7 @@ class MockSerialPackage(object):
                         if len(self.responseSequence) > 0:                            
                             self._setupReadValue(command)                    
                     else:                        
-                        self._readQueue = list(value)
+                        self._readQueue = [c.encode() for c in value]
 
         def write(self, data):            
             if self.writeCallbackFunc != None:
@@ -126,9 +126,24 @@ class TestNotifications(unittest.TestCase):
             serialComms.serial.responseSequence = copy(test)
             # Wait a bit for the event to be picked up
             while len(serialComms.serial._readQueue) > 0 or len(serialComms.serial.responseSequence) > 0:
-                time.sleep(0.05)            
+                time.sleep(0.05)
             serialComms.close()
 
+    def test_callbackBatchedRead(self):
+        """ Tests that a multi-line notification read in a single chunk is passed to the callback as one notification """
+        notifications = []
+        def callback(data):
+            notifications.append(data)
+
+        serialComms = gsmmodem.serial_comms.SerialComms('-- PORT IGNORED DURING TESTS --', notifyCallbackFunc=callback)
+        serialComms.connect()
+        # Fake a notification burst that arrives in one read
+        serialComms.serial._readQueue = [b'RING\r\n+CLIP: "+27820001234",145,,,,0\r\n']
+        while len(notifications) == 0:
+            time.sleep(0.05)
+        serialComms.close()
+        self.assertEqual(notifications, [['RING', '+CLIP: "+27820001234",145,,,,0']])
+
 class TestSerialException(unittest.TestCase):
     """ Tests SerialException handling """
     
@@ -192,8 +207,16 @@ class TestWrite(unittest.TestCase):
             self.assertEqual(response, expected)
             # Now write without expecting a response
             response = self.serialComms.write('test2\r', waitForResponse=False)
-            self.assertEqual(response, None) 
-    
+            self.assertEqual(response, None)
+
+    def test_writeBytes(self):
+        """ Tests that bytes data is written as-is, and str data is encoded """
+        written = []
+        self.serialComms.serial.writeCallbackFunc = written.append
+        self.serialComms.write(b'AT\r', waitForResponse=False)
+        self.serialComms.write('AT\r', waitForResponse=False)
+        self.assertEqual(written, [b'AT\r', b'AT\r'])
+
     def test_writeTimeout(self):
         """ Tests that the serial comms write timeout parameter """
         # Serial comms will not response (no response sequence specified)